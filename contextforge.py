@@ -5,24 +5,68 @@
 #   "rich",
 #   "pygithub",
 #   "gitpython",
-#   "pathspec"
+#   "pathspec>=0.12"
 # ]
 # ///
 
+import codecs
+import fnmatch
+import functools
+import io
 import json
+import mmap
 import os
 import re
 import shutil
+import stat
+import sys
 import tempfile
-from datetime import datetime
-from fnmatch import fnmatch
-from typing import Callable, List, Optional
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    TextIO,
+    Tuple,
+    Union,
+)
 
 import click
-from git import Repo
+from pathspec import GitIgnoreSpec
 from rich.console import Console
 from rich.theme import Theme
 
+def _json_dumps_ascii(obj, newline: bool = False) -> str:
+    """Serialize obj to compact JSON, escaping non-ASCII and lone surrogates."""
+    text = json.dumps(obj, separators=(",", ":"))
+    return text + "\n" if newline else text
+
+try:
+    import orjson
+
+    def json_dumps(obj, newline: bool = False) -> str:
+        """Serialize obj to compact JSON using orjson."""
+        option = orjson.OPT_APPEND_NEWLINE if newline else 0
+        try:
+            return orjson.dumps(obj, option=option).decode("utf-8")
+        except orjson.JSONEncodeError:
+            # Undecodable file names carry surrogate escapes orjson rejects
+            return _json_dumps_ascii(obj, newline)
+except ImportError:
+    def json_dumps(obj, newline: bool = False) -> str:
+        """Serialize obj to compact JSON matching orjson's output."""
+        text = json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+        try:
+            text.encode("utf-8")
+        except UnicodeEncodeError:
+            # Undecodable file names carry surrogate escapes; escape them
+            return _json_dumps_ascii(obj, newline)
+        return text + "\n" if newline else text
+
 # Create a custom theme for consistent styling
 custom_theme = Theme({
     "info": "cyan",
@@ -34,15 +78,25 @@ custom_theme = Theme({
 console = Console(theme=custom_theme)
 err_console = Console(theme=custom_theme, file=click.get_text_stream('stderr'))
 
-# Global document index used in XML output.
-document_index = 1
-
 # Constants
 GITHUB_URL_PATTERN = r"https?://github\.com/([^/]+)/([^/]+)"
+_GITHUB_URL_RE = re.compile(GITHUB_URL_PATTERN)
 TEMP_DIR_PREFIX = "contextforge_"
+SHALLOW_CLONE_OPTIONS = [
+    "--depth=1",
+    "--filter=blob:none",
+    "--single-branch",
+    "--no-tags",
+]
+OUTPUT_BUFFER_SIZE = 1 << 20  # 1 MiB
+READ_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+PREFETCH_WINDOW = READ_WORKERS * 4
+SNIFF_FULL_READ_SIZE = 64 * 1024  # read smaller files whole while sniffing
+STREAM_CHUNK_SIZE = 64 * 1024  # chunk size for streaming large files out
+_O_NOATIME = getattr(os, "O_NOATIME", 0)
 
 # Common binary file extensions and magic numbers
-BINARY_EXTENSIONS = {
+BINARY_EXTENSIONS = frozenset({
     # Executables and Libraries
     '.exe', '.dll', '.so', '.dylib', '.bin', '.pyc', '.pyo',
     # Images
@@ -53,7 +107,14 @@ BINARY_EXTENSIONS = {
     '.zip', '.tar', '.gz', '.7z', '.rar',
     # Other
     '.class', '.jar', '.war', '.ear'
-}
+})
+
+# Directories that are skipped without being entered unless --no-default-prune
+# is given; they are rarely useful as context and are often very large.
+DEFAULT_PRUNE_DIRS = frozenset({
+    '.git', 'node_modules', '__pycache__', '.venv', 'venv', 'target',
+    'build', 'dist', '.mypy_cache', '.pytest_cache', '.tox',
+})
 
 # Magic numbers (file signatures) for common binary formats
 MAGIC_NUMBERS = {
@@ -64,75 +125,140 @@ MAGIC_NUMBERS = {
     b'%PDF': '.pdf',
 }
 
-def should_ignore(path: str, ignore_rules: List[str]) -> bool:
-    basename = os.path.basename(path)
-    for rule in ignore_rules:
-        if fnmatch(basename, rule):
-            return True
-        if os.path.isdir(path) and fnmatch(basename + "/", rule):
-            return True
-    return False
+def _build_magic_table() -> List[Optional[Tuple[bytes, ...]]]:
+    """Group magic numbers by first byte so most files need one list lookup."""
+    table: List[Optional[Tuple[bytes, ...]]] = [None] * 256
+    for magic in MAGIC_NUMBERS:
+        table[magic[0]] = (table[magic[0]] or ()) + (magic,)
+    return table
+
+_MAGIC_BY_FIRST_BYTE = _build_magic_table()
 
-def read_gitignore(directory: str) -> List[str]:
+# Bytes considered text by is_binary_content (printable ASCII, high bytes and
+# common control characters), built once rather than on every call.
+_TEXT_BYTES = bytes(range(32, 127)) + bytes(range(128, 256)) + b'\n\r\t\f\b'
+
+def _compile_user_regex(pattern: Optional[str]) -> Optional[re.Pattern]:
+    """Compile the --regex pattern, raising a ClickException if it is invalid."""
+    if not pattern:
+        return None
+    try:
+        return re.compile(pattern)
+    except re.error as e:
+        err_console.print(f"[error]Invalid regex pattern: {pattern}[/error]")
+        raise click.ClickException(f"Invalid regex pattern: {pattern}") from e
+
+@functools.lru_cache(maxsize=500)
+def compile_ignore_patterns(patterns: tuple) -> Optional[re.Pattern]:
+    """
+    Compile glob-style --ignore patterns into a single name-matching regex.
+
+    Results are cached by pattern tuple, so repeated in-process invocations
+    with the same --ignore options reuse the compiled regex.
+    """
+    if not patterns:
+        return None
+    return re.compile("|".join(fnmatch.translate(p) for p in patterns))
+
+@functools.lru_cache(maxsize=1024)
+def _load_gitignore_cached(gitignore_path: str, mtime_ns: int) -> GitIgnoreSpec:
+    """
+    Parse a .gitignore file into a GitIgnoreSpec.
+
+    The modification time is part of the cache key, so repeated walks reuse
+    the parsed spec until the file changes.
+    """
+    with open(gitignore_path, "r", encoding="utf-8", errors="replace") as f:
+        return GitIgnoreSpec.from_lines(f)
+
+def read_gitignore(directory: str) -> Optional[GitIgnoreSpec]:
+    """Return the compiled .gitignore rules of directory, if it has any."""
     gitignore_path = os.path.join(directory, ".gitignore")
-    if os.path.isfile(gitignore_path):
-        with open(gitignore_path, "r") as f:
-            return [
-                line.strip()
-                for line in f
-                if line.strip() and not line.startswith("#")
-            ]
-    return []
+    try:
+        st = os.stat(gitignore_path)
+    except OSError:
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+    return _load_gitignore_cached(gitignore_path, st.st_mtime_ns)
 
 def add_line_numbers(content: str) -> str:
     lines = content.splitlines()
-    padding = len(str(len(lines)))
-    numbered_lines = [f"{i+1:{padding}}  {line}" for i, line in enumerate(lines)]
-    return "\n".join(numbered_lines)
+    # One bound %-format applied by map() avoids a per-line f-string spec parse
+    number = f"%{len(str(len(lines)))}d  %s".__mod__
+    return "\n".join(map(number, enumerate(lines, 1)))
+
+def write_numbered(writer: Callable[[str], None], file_path: str) -> None:
+    """Stream a file to writer with line numbers, matching add_line_numbers output."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        # Split on every boundary str.splitlines knows, not only on "\n"
+        padding = len(str(sum(len(line.splitlines()) for line in f)))
+        f.seek(0)
+        number = f"%{padding}d  %s".__mod__
+        sep = ""
+        i = 0
+        for line in f:
+            for part in line.splitlines():
+                i += 1
+                writer(sep + number((i, part)))
+                sep = "\n"
+
+class _WriterFile:
+    """Minimal file-like adapter so shutil.copyfileobj can target a writer."""
+
+    __slots__ = ("write",)
+
+    def __init__(self, writer: Callable[[str], None]) -> None:
+        self.write = writer
+
+def write_streamed(writer: Callable[[str], None], file_path: str) -> None:
+    """Stream a file to writer in STREAM_CHUNK_SIZE pieces."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        shutil.copyfileobj(f, _WriterFile(writer), STREAM_CHUNK_SIZE)
 
 def print_repo_tree(writer: Callable[[str], None], base_path: str, max_depth: int = 1):
     """
     Print a simplified repository tree (up to a certain depth).
     Skips large subdirectories or deeply nested structures.
     """
-    writer("\n[DATASET-MODE] Repository Tree Overview\n")
-    writer("----------------------------------------\n")
+    parts: List[str] = []
+    out = parts.append
+    out("\n[DATASET-MODE] Repository Tree Overview\n")
+    out("----------------------------------------\n")
 
-    def walk_dir(current_path: str, depth: int = 0):
-        if depth > max_depth:
-            return
+    def scan(current_path: str) -> List[os.DirEntry]:
         try:
-            entries = sorted(os.listdir(current_path))
-        except PermissionError:
-            return
-        dirs = []
-        files = []
-        for entry in entries:
-            full_entry = os.path.join(current_path, entry)
-            if os.path.isdir(full_entry):
-                dirs.append(entry)
-            else:
-                files.append(entry)
+            with os.scandir(current_path) as it:
+                return sorted(it, key=lambda e: e.name)
+        except OSError:
+            return []
+
+    def walk_dir(entries: List[os.DirEntry], depth: int = 0):
+        # DirEntry caches its type, so partitioning needs no extra stat calls
+        dirs = [e for e in entries if e.is_dir()]
+        files = [e for e in entries if not e.is_dir()]
+        indent = "  " * depth
         # Print dirs
         for d in dirs:
-            rel_dir = os.path.relpath(os.path.join(current_path, d), base_path)
-            indent = "  " * depth
-            writer(f"{indent}📂 {rel_dir}/\n")
-            # If there's a huge subdir, let's not expand it (simple heuristic)
-            sub_entries = os.listdir(os.path.join(current_path, d))
+            rel_dir = os.path.relpath(d.path, base_path)
+            out(f"{indent}📂 {rel_dir}/\n")
+            # If there's a huge subdir, let's not expand it (simple heuristic).
+            # The listing is reused for the expansion, so it is read only once.
+            sub_entries = scan(d.path)
             if len(sub_entries) < 50:  # you can tweak this threshold
-                walk_dir(os.path.join(current_path, d), depth + 1)
+                if depth < max_depth:
+                    walk_dir(sub_entries, depth + 1)
             else:
-                writer(f"{indent}  (... {len(sub_entries)} items omitted ...)\n")
+                out(f"{indent}  (... {len(sub_entries)} items omitted ...)\n")
         # Print files
         for f in files:
-            rel_file = os.path.relpath(os.path.join(current_path, f), base_path)
-            indent = "  " * depth
-            writer(f"{indent}📄 {rel_file}\n")
+            rel_file = os.path.relpath(f.path, base_path)
+            out(f"{indent}📄 {rel_file}\n")
 
     # Start from base_path
-    walk_dir(base_path, depth=0)
-    writer("\n")
+    walk_dir(scan(base_path), depth=0)
+    out("\n")
+    writer("".join(parts))
 
 def print_file_summary(writer: Callable[[str], None], file_path: str):
     """Print a lightweight file summary line."""
@@ -157,170 +283,411 @@ def print_file_summary(writer: Callable[[str], None], file_path: str):
         # fallback if any error reading file
         writer(f"[SUMMARY] {file_path} (unavailable)\n")
 
-def print_default(
-    writer: Callable[[str], None],
-    path: str,
-    content: str,
-    line_numbers: bool,
-    dataset_mode: bool,
-) -> None:
-    """Print file content in plain text format, with optional dataset-mode delimiter."""
-    if dataset_mode:
-        # Unique delimiter for dataset mode
-        writer(f"\n===== FILE BEGIN: {path} =====\n")
-    else:
-        writer(f"{path}\n")
-        writer("---\n")
-
-    writer(add_line_numbers(content) if line_numbers else content)
-
-    if dataset_mode:
-        writer(f"\n===== FILE END: {path} =====\n\n")
-    else:
-        # Add newlines and marker for separation
-        writer("\n\n---\n\n")
-
-def print_as_xml(
-    writer: Callable[[str], None], 
-    path: str, 
-    content: str, 
-    line_numbers: bool
-) -> None:
-    global document_index
-    writer(f"<document index=\"{document_index}\">\n")
-    writer(f"<source>{path}</source>\n")
-    writer("<document_content>\n")
-    writer(add_line_numbers(content) if line_numbers else content)
-    writer("\n</document_content>\n")
-    writer("</document>\n")
-    document_index += 1
-
-def print_as_json(
-    writer: Callable[[str], None], 
-    path: str, 
-    content: str, 
-    line_numbers: bool
-) -> None:
-    """Print content in JSON format."""
-    data = {
-        "path": path,
-        "content": add_line_numbers(content) if line_numbers else content
-    }
-    writer(json.dumps(data))  # No newline for JSON array format
-
-def print_as_jsonl(
-    writer: Callable[[str], None], 
-    path: str, 
-    content: str, 
-    line_numbers: bool
-) -> None:
-    """Print content in JSONL format (one JSON object per line)."""
-    data = {
-        "path": path,
-        "content": add_line_numbers(content) if line_numbers else content
-    }
-    writer(json.dumps(data) + "\n")
-
-def print_path(writer: Callable[[str], None], path: str, content: str,
-               use_xml: bool, use_json: bool, use_jsonl: bool,
-               line_numbers: bool, dataset_mode: bool) -> None:
-    """
-    Print the file content using the selected output format,
-    optionally including dataset-mode extras.
-    """
-    if use_xml:
-        print_as_xml(writer, path, content, line_numbers)
-    elif use_json:
-        print_as_json(writer, path, content, line_numbers)
-    elif use_jsonl:
-        print_as_jsonl(writer, path, content, line_numbers)
-    else:
-        print_default(writer, path, content, line_numbers, dataset_mode)
+class Formatter:
+    """Format files for one output format, keeping the per-run output state."""
+
+    __slots__ = (
+        "writer", "printer", "line_numbers", "dataset_mode",
+        "index", "json_entry_written",
+    )
+
+    def __init__(self, writer: Callable[[str], None],
+                 use_xml: bool, use_json: bool, use_jsonl: bool,
+                 line_numbers: bool, dataset_mode: bool) -> None:
+        self.writer = writer
+        self.line_numbers = line_numbers
+        self.dataset_mode = dataset_mode
+        self.index = 1
+        self.json_entry_written = False
+        if use_xml:
+            self.printer = self.print_as_xml
+        elif use_json:
+            self.printer = self.print_as_json
+        elif use_jsonl:
+            self.printer = self.print_as_jsonl
+        else:
+            self.printer = self.print_default
+
+    def emit(self, path: str, content: Optional[str]) -> None:
+        """
+        Print one file, handing its fragments to the writer in one call.
+
+        Streamed content (content is None) goes straight to the buffered
+        writer instead.
+        """
+        if content is None:
+            self.printer(self.writer, path, content)
+            return
+        parts: List[str] = []
+        self.printer(parts.append, path, content)
+        self.writer("".join(parts))
+
+    def stream(self, writer: Callable[[str], None], path: str) -> None:
+        """
+        Stream a file's content from disk, numbering lines if requested.
+
+        The file must already have been checked for valid UTF-8, as _read_file does.
+        """
+        if self.line_numbers:
+            write_numbered(writer, path)
+        else:
+            write_streamed(writer, path)
+
+    def print_default(
+        self, writer: Callable[[str], None], path: str, content: Optional[str]
+    ) -> None:
+        """
+        Print file content in plain text format, with optional dataset-mode delimiter.
+
+        If content is None, the file at path is streamed from disk.
+        """
+        if self.dataset_mode:
+            # Unique delimiter for dataset mode
+            writer(f"\n===== FILE BEGIN: {path} =====\n")
+        else:
+            writer(f"{path}\n---\n")
+
+        if content is None:
+            self.stream(writer, path)
+        else:
+            writer(add_line_numbers(content) if self.line_numbers else content)
+
+        if self.dataset_mode:
+            writer(f"\n===== FILE END: {path} =====\n\n")
+        else:
+            # Add newlines and marker for separation
+            writer("\n\n---\n\n")
+
+    def print_as_xml(
+        self, writer: Callable[[str], None], path: str, content: Optional[str]
+    ) -> None:
+        writer(
+            f"<document index=\"{self.index}\">\n"
+            f"<source>{path}</source>\n"
+            "<document_content>\n"
+        )
+        if content is None:
+            self.stream(writer, path)
+        else:
+            writer(add_line_numbers(content) if self.line_numbers else content)
+        writer("\n</document_content>\n</document>\n")
+        self.index += 1
+
+    def print_as_json(
+        self, writer: Callable[[str], None], path: str, content: str
+    ) -> None:
+        """Print content as a JSON array entry, preceded by a comma if needed."""
+        data = {
+            "path": path,
+            "content": add_line_numbers(content) if self.line_numbers else content
+        }
+        if self.json_entry_written:
+            writer(",\n")
+        writer(json_dumps(data))  # No newline for JSON array format
+        self.json_entry_written = True
+
+    def print_as_jsonl(
+        self, writer: Callable[[str], None], path: str, content: str
+    ) -> None:
+        """Print content in JSONL format (one JSON object per line)."""
+        data = {
+            "path": path,
+            "content": add_line_numbers(content) if self.line_numbers else content
+        }
+        writer(json_dumps(data, newline=True))
 
 def should_include_file(
     file_path: str,
     extensions: tuple,
-    regex_pattern: Optional[str],
+    regex_re: Optional[re.Pattern],
     min_size: Optional[int],
     max_size: Optional[int],
-    modified_after: Optional[datetime],
+    modified_after_ts: Optional[float],
+    entry: Optional[os.DirEntry] = None,
 ) -> bool:
-    if extensions and not any(file_path.endswith(ext) for ext in extensions):
+    """
+    Apply the extension, regex, size and mtime filters to one file.
+
+    The file is only stat'ed when a size or mtime filter is set, through
+    ``entry`` when the walk supplied its DirEntry.
+    """
+    if extensions and not file_path.endswith(extensions):
         return False
-    if regex_pattern and not re.search(regex_pattern, file_path):
+    if regex_re and not regex_re.search(file_path):
         return False
+    if min_size is None and max_size is None and modified_after_ts is None:
+        return True
     try:
-        stats = os.stat(file_path)
+        stats = entry.stat() if entry is not None else os.stat(file_path)
     except OSError:
         return False
     if min_size is not None and stats.st_size < min_size:
         return False
     if max_size is not None and stats.st_size > max_size:
         return False
-    if modified_after is not None:
-        mod_time = datetime.fromtimestamp(stats.st_mtime)
-        if mod_time < modified_after:
-            return False
+    if modified_after_ts is not None and stats.st_mtime < modified_after_ts:
+        return False
     return True
 
 def is_binary_content(content: bytes, sample_size: int = 1024) -> bool:
     """Check if content appears to be binary using a heuristic."""
-    if b'\x00' in content[:sample_size]:
+    sample = content[:sample_size]
+    if not sample:
+        return False
+    if b'\x00' in sample:
         return True
+    # Deleting every text byte leaves only the non-text ones, all in C
+    non_text = len(sample.translate(None, _TEXT_BYTES))
+    return non_text / len(sample) > 0.30
 
-    text_characters = (
-        b''.join(map(bytes, [range(32, 127)]))
-        + b''.join(map(bytes, [range(128, 256)]))
-        + b'\n\r\t\f\b'
-    )
-    non_text = sum(byte not in text_characters for byte in content[:sample_size])
-    return non_text / len(content[:sample_size]) > 0.30
+def _open_readonly(file_path: str) -> int:
+    """Open a file descriptor for reading, with O_NOATIME where permitted."""
+    flags = os.O_RDONLY | getattr(os, "O_BINARY", 0)
+    try:
+        return os.open(file_path, flags | _O_NOATIME)
+    except PermissionError:
+        if not _O_NOATIME:
+            raise
+        # O_NOATIME is only allowed for the file's owner
+        return os.open(file_path, flags)
 
-def is_binary_file(file_path: str) -> bool:
-    """Determine if a file is binary using multiple methods."""
-    # 1. Check extension first (fast path)
-    if any(file_path.lower().endswith(ext) for ext in BINARY_EXTENSIONS):
+def _map_fd(fd: int) -> mmap.mmap:
+    """Memory-map an open file read-only, hinting readahead where supported."""
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+    mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, "MADV_SEQUENTIAL"):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    return mm
+
+def _header_is_binary(header: bytes) -> bool:
+    """Check a file's leading bytes for magic numbers and non-text content."""
+    if not header:
+        return False
+    # Check magic numbers; the first byte rules out most formats at once
+    candidates = _MAGIC_BY_FIRST_BYTE[header[0]]
+    if candidates and header.startswith(candidates):
         return True
+    return is_binary_content(header)
+
+def sniff_file(
+    file_path: str, read_content: bool = False
+) -> Tuple[bool, Optional[Union[bytes, mmap.mmap]]]:
+    """
+    Determine if a file is binary, returning (is_binary, content).
+
+    With read_content, a text file's content is returned too, memory-mapped
+    if it is larger than SNIFF_FULL_READ_SIZE; the caller must close an mmap.
+    """
+    # 1. Check extension first (fast path)
+    if os.path.splitext(file_path)[1].lower() in BINARY_EXTENSIONS:
+        return True, None
 
     try:
-        # 2. Read first 8KB for magic numbers and content analysis
-        with open(file_path, 'rb') as f:
-            header = f.read(8192)
-            if not header:
-                return False
-            # Check magic numbers
-            for magic, _ in MAGIC_NUMBERS.items():
-                if header.startswith(magic):
-                    return True
-            return is_binary_content(header)
-    except (OSError, IOError) as e:
+        # 2. Read the first 8KB (or the whole file) for content analysis
+        fd = _open_readonly(file_path)
+        try:
+            data = os.read(fd, SNIFF_FULL_READ_SIZE + 1 if read_content else 8192)
+            if _header_is_binary(data[:8192]):
+                return True, None
+            # Only a text file worth reading in full is mapped
+            if read_content and len(data) > SNIFF_FULL_READ_SIZE:
+                data = _map_fd(fd)
+        finally:
+            os.close(fd)
+    except (OSError, IOError, ValueError) as e:
         err_console.print(
             f"[warning]Warning: Error reading {file_path}: "
             f"{str(e)}[/warning]"
         )
-        return True  # Treat as binary on error
+        return True, None  # Treat as binary on error
+
+    return False, data if read_content else None
+
+def is_binary_file(file_path: str) -> bool:
+    """Determine if a file is binary using multiple methods."""
+    return sniff_file(file_path)[0]
+
+def decode_text(data: Union[bytes, mmap.mmap]) -> str:
+    """Decode UTF-8 bytes with the same newline handling as text-mode open()."""
+    text = str(data, "utf-8")
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+def _is_utf8(data: mmap.mmap) -> bool:
+    """Check that data is valid UTF-8, decoding a chunk at a time."""
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        for start in range(0, len(data), STREAM_CHUNK_SIZE):
+            decoder.decode(data[start:start + STREAM_CHUNK_SIZE])
+        decoder.decode(b"", final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+def _is_gitignored(
+    chain: Tuple[Tuple[int, GitIgnoreSpec], ...], entry_path: str, is_dir: bool
+) -> bool:
+    """
+    Check a path against stacked (prefix_len, spec) .gitignore rules.
 
+    Each spec matches paths relative to its own directory, and the deepest
+    .gitignore with a matching rule decides, as in git.
+    """
+    for prefix_len, spec in reversed(chain):
+        rel_path = entry_path[prefix_len:]
+        result = spec.check_file(rel_path + "/" if is_dir else rel_path)
+        if result.include is not None:
+            return result.include
     return False
 
+def _iter_tree(
+    path: str,
+    include_hidden: bool,
+    gitignore_spec: Optional[GitIgnoreSpec],
+    ignore_re: Optional[re.Pattern],
+    ignore_files_only: bool,
+    prune_dirs: frozenset = DEFAULT_PRUNE_DIRS,
+    nested_gitignore: bool = False,
+    sort_entries: bool = True,
+) -> Iterator[os.DirEntry]:
+    """
+    Walk a directory tree with os.scandir, yielding a DirEntry for each file.
+
+    Pruned and ignored directories are never entered.
+    """
+    def keep(entry: os.DirEntry, is_dir: bool, chain) -> bool:
+        # Default pruning, gitignore and --ignore rules in a single pass
+        if is_dir:
+            if entry.name in prune_dirs:
+                return False
+            if ignore_files_only:
+                return True
+        if chain and _is_gitignored(chain, entry.path, is_dir):
+            return False
+        return not (ignore_re and ignore_re.match(entry.name))
+
+    root_chain: Tuple[Tuple[int, GitIgnoreSpec], ...] = ()
+    if gitignore_spec:
+        root_chain = ((len(os.path.join(path, "")), gitignore_spec),)
+    stack = [(path, root_chain)]
+    while stack:
+        current, chain = stack.pop()
+        try:
+            with os.scandir(current) as it:
+                entries = list(it)
+        except OSError:
+            continue
+        if sort_entries:
+            entries.sort(key=lambda e: e.name)
+
+        if nested_gitignore and current != path:
+            for entry in entries:
+                if entry.name == ".gitignore":
+                    try:
+                        if entry.is_file():
+                            spec = _load_gitignore_cached(
+                                entry.path, entry.stat().st_mtime_ns
+                            )
+                            prefix_len = len(os.path.join(current, ""))
+                            chain = chain + ((prefix_len, spec),)
+                    except OSError:
+                        pass
+                    break
+
+        subdirs = []
+        for entry in entries:
+            if not include_hidden and entry.name.startswith("."):
+                continue
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                if not is_dir and not entry.is_file():
+                    continue
+            except OSError:
+                continue
+
+            if not keep(entry, is_dir, chain):
+                continue
+            if is_dir:
+                subdirs.append(entry.path)
+                continue
+            yield entry
+
+        # Push in reverse so subdirectories are visited in listing order
+        stack.extend((d, chain) for d in reversed(subdirs))
+
+def _read_file(
+    file_path: str, stream_large: bool = False
+) -> Tuple[str, bool, Optional[Union[str, mmap.mmap]]]:
+    """
+    Sniff a file and read its text in a worker, returning (path, is_text, content).
+
+    Large files come back mapped, or with stream_large validated with content None.
+    """
+    is_binary, data = sniff_file(file_path, read_content=True)
+    if is_binary:
+        return file_path, False, None
+    if isinstance(data, mmap.mmap):
+        if not stream_large:
+            return file_path, True, data
+        with data:
+            return file_path, _is_utf8(data), None
+    try:
+        return file_path, True, decode_text(data)
+    except UnicodeDecodeError:
+        return file_path, False, None
+
+def _decode_mapped(
+    result: Tuple[str, bool, Optional[Union[str, mmap.mmap]]]
+) -> Tuple[str, bool, Optional[str]]:
+    """Decode a mapped file from _read_file, closing the mapping."""
+    file_path, is_text, data = result
+    if not isinstance(data, mmap.mmap):
+        return result
+    with data:
+        try:
+            return file_path, True, decode_text(data)
+        except UnicodeDecodeError:
+            return file_path, False, None
+
+def _prefetch_files(
+    files: Iterable[str], stream_large: bool = False
+) -> Iterator[Tuple[str, bool, Optional[str]]]:
+    """
+    Read files on a thread pool while yielding results in submission order.
+
+    Mapped large files are decoded here, on the consuming thread, one at a time.
+    """
+    with ThreadPoolExecutor(max_workers=READ_WORKERS) as pool:
+        pending: Deque[Future] = deque()
+        for file_path in files:
+            pending.append(pool.submit(
+                _read_file, file_path, stream_large
+            ))
+            if len(pending) >= PREFETCH_WINDOW:
+                yield _decode_mapped(pending.popleft().result())
+        while pending:
+            yield _decode_mapped(pending.popleft().result())
+
 def process_local_path(
     path: str,
     extensions: tuple,
     include_hidden: bool,
     ignore_files_only: bool,
     ignore_gitignore: bool,
-    gitignore_rules: List[str],
-    ignore_patterns: tuple,
+    gitignore_spec: Optional[GitIgnoreSpec],
+    ignore_re: Optional[re.Pattern],
     writer: Callable[[str], None],
-    use_xml: bool,
-    use_json: bool,
-    use_jsonl: bool,
-    line_numbers: bool,
-    regex_pattern: Optional[str],
+    emit: Callable[[str, Optional[str]], None],
+    regex_re: Optional[re.Pattern],
     min_size: Optional[int],
     max_size: Optional[int],
-    modified_after: Optional[datetime],
-    first_json_entry: bool,
-    dataset_mode: bool = False
+    modified_after_ts: Optional[float],
+    dataset_mode: bool = False,
+    prune_dirs: frozenset = DEFAULT_PRUNE_DIRS,
+    sort_entries: bool = True,
+    stream_large: bool = False
 ) -> int:
     """Process a local path and print file contents based on filtering options."""
     if not os.path.exists(path):
@@ -336,86 +703,48 @@ def process_local_path(
             print_repo_tree(writer, path, max_depth=1)
 
         if os.path.isfile(path):
+            # Same read path as directory entries, so a large file is
+            # memory-mapped rather than copied into a read() buffer
+            files = []
             if should_include_file(
-                path, extensions, regex_pattern, min_size, max_size, modified_after
+                path, extensions, regex_re, min_size, max_size,
+                modified_after_ts,
             ):
-                if not is_binary_file(path):
-                    if dataset_mode:
-                        print_file_summary(writer, path)
-                    with open(path, "r", encoding="utf-8") as f:
-                        content = f.read()
-                    print_path(
-                        writer,
-                        path,
-                        content,
-                        use_xml,
-                        use_json,
-                        use_jsonl,
-                        line_numbers,
-                        dataset_mode
-                    )
+                files.append(path)
         else:
-            for root, dirs, files in os.walk(path):
-                if not include_hidden:
-                    dirs[:] = [d for d in dirs if not d.startswith(".")]
-                    files = [f for f in files if not f.startswith(".")]
-
-                if not ignore_gitignore and gitignore_rules:
-                    dirs[:] = [
-                        d for d in dirs
-                        if (
-                            ignore_files_only or
-                            not should_ignore(os.path.join(root, d), gitignore_rules)
-                        )
-                    ]
-                    files = [
-                        f for f in files
-                        if not should_ignore(os.path.join(root, f), gitignore_rules)
-                    ]
-
-                if ignore_patterns:
-                    if not ignore_files_only:
-                        dirs[:] = [
-                            d for d in dirs
-                            if not any(
-                                fnmatch(d, pattern) for pattern in ignore_patterns
-                            )
-                        ]
-                    files = [
-                        f for f in files
-                        if not any(
-                            fnmatch(f, pattern) for pattern in ignore_patterns
-                        )
-                    ]
-
-                for file in sorted(files):
-                    file_path = os.path.join(root, file)
-                    if should_include_file(
-                        file_path,
-                        extensions,
-                        regex_pattern,
-                        min_size,
-                        max_size,
-                        modified_after
-                    ):
-                        if not is_binary_file(file_path):
-                            if dataset_mode:
-                                print_file_summary(writer, file_path)
-                            try:
-                                with open(file_path, "r", encoding="utf-8") as f:
-                                    content = f.read()
-                                print_path(
-                                    writer,
-                                    file_path,
-                                    content,
-                                    use_xml,
-                                    use_json,
-                                    use_jsonl,
-                                    line_numbers,
-                                    dataset_mode
-                                )
-                            except UnicodeDecodeError:
-                                continue
+            files = (
+                entry.path
+                for entry in _iter_tree(
+                    path,
+                    include_hidden,
+                    gitignore_spec,
+                    ignore_re,
+                    ignore_files_only,
+                    prune_dirs,
+                    nested_gitignore=not ignore_gitignore,
+                    sort_entries=sort_entries,
+                )
+                if should_include_file(
+                    entry.path,
+                    extensions,
+                    regex_re,
+                    min_size,
+                    max_size,
+                    modified_after_ts,
+                    entry=entry,
+                )
+            )
+        for file_path, is_text, content in _prefetch_files(
+            files, stream_large
+        ):
+            if not is_text:
+                continue
+            if dataset_mode:
+                print_file_summary(writer, file_path)
+            try:
+                emit(file_path, content)
+            except UnicodeDecodeError:
+                continue
     except Exception as e:
         err_console.print(
             f"[error]Error processing {path}: {str(e)}[/error]"
@@ -424,13 +753,41 @@ def process_local_path(
 
     return 0
 
+def open_output_stream(output_file: Optional[str]) -> TextIO:
+    """
+    Open the output destination as a UTF-8 text stream.
+
+    Writes are buffered and only flushed when the stream is closed (for files)
+    or flushed explicitly (for stdout), instead of once per writer call.
+    """
+    if output_file:
+        return open(
+            output_file, "w", encoding="utf-8", buffering=OUTPUT_BUFFER_SIZE
+        )
+    return io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", write_through=False)
+
+@functools.lru_cache(maxsize=256)
 def is_github_url(url: str) -> bool:
-    return bool(re.match(GITHUB_URL_PATTERN, url))
+    return _GITHUB_URL_RE.match(url) is not None
 
 def clone_github_repo(url: str) -> str:
+    """
+    Clone a repository into a temporary directory.
+
+    Only the latest commit is fetched, falling back to a full clone if refused.
+    """
+    from git import GitCommandError, Repo
+
     temp_dir = tempfile.mkdtemp(prefix=TEMP_DIR_PREFIX)
     try:
-        Repo.clone_from(url, temp_dir)
+        try:
+            Repo.clone_from(url, temp_dir, multi_options=SHALLOW_CLONE_OPTIONS)
+        except GitCommandError as e:
+            if "does not support" not in str(e):
+                raise
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            os.mkdir(temp_dir)
+            Repo.clone_from(url, temp_dir)
         return temp_dir
     except Exception as e:
         shutil.rmtree(temp_dir, ignore_errors=True)
@@ -444,42 +801,40 @@ def process_github_url(
     include_hidden: bool,
     ignore_files_only: bool,
     ignore_gitignore: bool,
-    ignore_patterns: tuple,
+    ignore_re: Optional[re.Pattern],
     writer: Callable[[str], None],
-    use_xml: bool,
-    use_json: bool,
-    use_jsonl: bool,
-    line_numbers: bool,
-    regex_pattern: Optional[str],
+    emit: Callable[[str, Optional[str]], None],
+    regex_re: Optional[re.Pattern],
     min_size: Optional[int],
     max_size: Optional[int],
-    modified_after: Optional[datetime],
-    first_json_entry: bool,
-    dataset_mode: bool = False
+    modified_after_ts: Optional[float],
+    dataset_mode: bool = False,
+    prune_dirs: frozenset = DEFAULT_PRUNE_DIRS,
+    sort_entries: bool = True,
+    stream_large: bool = False
 ) -> None:
     try:
         temp_dir = clone_github_repo(url)
         try:
-            rules = [] if ignore_gitignore else read_gitignore(temp_dir)
+            gitignore_spec = None if ignore_gitignore else read_gitignore(temp_dir)
             process_local_path(
                 temp_dir,
                 extensions,
                 include_hidden,
                 ignore_files_only,
                 ignore_gitignore,
-                rules,
-                ignore_patterns,
+                gitignore_spec,
+                ignore_re,
                 writer,
-                use_xml,
-                use_json,
-                use_jsonl,
-                line_numbers,
-                regex_pattern,
+                emit,
+                regex_re,
                 min_size,
                 max_size,
-                modified_after,
-                first_json_entry,
-                dataset_mode=dataset_mode
+                modified_after_ts,
+                dataset_mode=dataset_mode,
+                prune_dirs=prune_dirs,
+                sort_entries=sort_entries,
+                stream_large=stream_large
             )
         finally:
             shutil.rmtree(temp_dir, ignore_errors=True)
@@ -513,6 +868,11 @@ def process_github_url(
     is_flag=True,
     help="Ignore .gitignore files and include all files"
 )
+@click.option(
+    "--no-default-prune",
+    is_flag=True,
+    help="Also walk directories skipped by default (.git, node_modules, build, ...)"
+)
 @click.option(
     "--ignore",
     "ignore_patterns",
@@ -569,6 +929,11 @@ def process_github_url(
     is_flag=True,
     help="Add line numbers to the output"
 )
+@click.option(
+    "--no-sort",
+    is_flag=True,
+    help="Emit files in filesystem order instead of sorted order (faster walk)"
+)
 @click.option(
     "--dataset-mode",
     is_flag=True,
@@ -581,6 +946,7 @@ def cli(
     include_hidden,
     ignore_files_only,
     ignore_gitignore,
+    no_default_prune,
     ignore_patterns,
     regex_pattern,
     min_size,
@@ -591,6 +957,7 @@ def cli(
     use_json,
     use_jsonl,
     line_numbers,
+    no_sort,
     dataset_mode
 ):
     """Process and filter code from files and GitHub repositories.
@@ -601,96 +968,102 @@ def cli(
     """
     err_console.print("[info]🔍 ContextForge - Processing files...[/info]")
 
-    # Validate regex pattern
-    if regex_pattern:
-        try:
-            re.compile(regex_pattern)
-        except re.error as e:
-            err_console.print(f"[error]Invalid regex pattern: {regex_pattern}[/error]")
-            raise click.ClickException(
-                f"Invalid regex pattern: {regex_pattern}"
-            ) from e
+    # Validate and compile the regex pattern once for all files
+    regex_re = _compile_user_regex(regex_pattern)
 
     if sum([use_xml, use_json, use_jsonl]) > 1:
         raise click.ClickException("Cannot use multiple output formats simultaneously")
 
-    output_stream = None
-    if output_file:
-        output_stream = open(output_file, "w", encoding="utf-8")
-        writer = output_stream.write
-    else:
-        def writer(s: str) -> None:
-            click.echo(s, nl=False)
-
-    if use_xml:
-        writer("<documents>\n")
-    elif use_json:
-        writer("[\n")  # Start JSON array
-
-    # Process each provided path
-    first_json_entry = True
-    for path in paths:
-        # For local paths, if the path does not exist, raise an error.
-        if not is_github_url(path) and not os.path.exists(path):
-            msg = f"Error processing {path}: No such file or directory"
-            raise click.ClickException(msg)
-        try:
-            if is_github_url(path):
-                process_github_url(
-                    path,
-                    extensions,
-                    include_hidden,
-                    ignore_files_only,
-                    ignore_gitignore,
-                    ignore_patterns,
-                    writer,
-                    use_xml,
-                    use_json,
-                    use_jsonl,
-                    line_numbers,
-                    regex_pattern,
-                    min_size,
-                    max_size,
-                    modified_after,
-                    first_json_entry,
-                    dataset_mode=dataset_mode
-                )
-            else:
-                rules = [] if ignore_gitignore else read_gitignore(path)
-                result = process_local_path(
-                    path,
-                    extensions,
-                    include_hidden,
-                    ignore_files_only,
-                    ignore_gitignore,
-                    rules,
-                    ignore_patterns,
-                    writer,
-                    use_xml,
-                    use_json,
-                    use_jsonl,
-                    line_numbers,
-                    regex_pattern,
-                    min_size,
-                    max_size,
-                    modified_after,
-                    first_json_entry,
-                    dataset_mode=dataset_mode
-                )
-                if result != 0:
-                    raise click.ClickException(f"Error processing {path}")
-            first_json_entry = False
-        except click.ClickException as e:
-            err_console.print(f"[error]{str(e)}[/error]")
-            raise e
-
-    if use_xml:
-        writer("</documents>\n")
-    elif use_json:
-        writer("\n]\n")  # End JSON array
-
-    if output_stream:
-        output_stream.close()
+    # Normalize "py" and ".py" alike so str.endswith can take the whole tuple
+    extensions = tuple(
+        ext if ext.startswith(".") else f".{ext}" for ext in extensions
+    )
+    ignore_re = compile_ignore_patterns(ignore_patterns)
+    prune_dirs = frozenset() if no_default_prune else DEFAULT_PRUNE_DIRS
+    # Compare raw st_mtime floats instead of building a datetime per file
+    modified_after_ts = modified_after.timestamp() if modified_after else None
+
+    output_stream = open_output_stream(output_file)
+    writer = output_stream.write
+    emit = Formatter(
+        writer, use_xml, use_json, use_jsonl, line_numbers, dataset_mode
+    ).emit
+    # Plain text and XML stream large files from disk; JSON and JSONL need
+    # the whole content as one string, so it is read into memory.
+    stream_large = not (use_json or use_jsonl)
+    try:
+        if use_xml:
+            writer("<documents>\n")
+        elif use_json:
+            writer("[\n")  # Start JSON array
+
+        # Process each provided path
+        for path in paths:
+            is_github = is_github_url(path)
+            # For local paths, if the path does not exist, raise an error.
+            if not is_github and not os.path.exists(path):
+                msg = f"Error processing {path}: No such file or directory"
+                raise click.ClickException(msg)
+            try:
+                if is_github:
+                    process_github_url(
+                        path,
+                        extensions,
+                        include_hidden,
+                        ignore_files_only,
+                        ignore_gitignore,
+                        ignore_re,
+                        writer,
+                        emit,
+                        regex_re,
+                        min_size,
+                        max_size,
+                        modified_after_ts,
+                        dataset_mode=dataset_mode,
+                        prune_dirs=prune_dirs,
+                        sort_entries=not no_sort,
+                        stream_large=stream_large
+                    )
+                else:
+                    gitignore_spec = (
+                        None if ignore_gitignore else read_gitignore(path)
+                    )
+                    result = process_local_path(
+                        path,
+                        extensions,
+                        include_hidden,
+                        ignore_files_only,
+                        ignore_gitignore,
+                        gitignore_spec,
+                        ignore_re,
+                        writer,
+                        emit,
+                        regex_re,
+                        min_size,
+                        max_size,
+                        modified_after_ts,
+                        dataset_mode=dataset_mode,
+                        prune_dirs=prune_dirs,
+                        sort_entries=not no_sort,
+                        stream_large=stream_large
+                    )
+                    if result != 0:
+                        raise click.ClickException(f"Error processing {path}")
+            except click.ClickException as e:
+                err_console.print(f"[error]{str(e)}[/error]")
+                raise e
+
+        if use_xml:
+            writer("</documents>\n")
+        elif use_json:
+            writer("\n]\n")  # End JSON array
+    finally:
+        if output_file:
+            output_stream.close()
+        else:
+            # Flush and release stdout without closing it
+            output_stream.flush()
+            output_stream.detach()
 
     err_console.print("\n[success]✨ Processing complete![/success]")
     return 0
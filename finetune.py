@@ -1,15 +1,33 @@
 #!/usr/bin/env python3
 import ast
+import asyncio
+import io
 import json
 import os
 import random
+import re
 import shutil
 import subprocess
 import tempfile
-from typing import Dict, List
+from typing import Dict, List, Optional
 
 import vertexai
 
+try:
+    import orjson
+
+    json_loads = orjson.loads
+
+    def json_line(obj) -> bytes:
+        """Serialize obj as one JSONL line using orjson."""
+        return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE)
+except ImportError:
+    json_loads = json.loads  # also accepts bytes
+
+    def json_line(obj) -> bytes:
+        """Serialize obj as one JSONL line using the standard library."""
+        return (json.dumps(obj) + "\n").encode("utf-8")
+
 # Vertex AI imports
 from rich.console import Console
 from vertexai.language_models import TextGenerationModel
@@ -35,6 +53,15 @@ MLX_CMD = (
     "--steps-per-report 10 --steps-per-eval 50 "
     "--val-batches 20 --adapter-path docstring_adapter"
 )
+# Maximum number of Vertex AI enhancement requests in flight at once
+ENHANCE_CONCURRENCY = 16
+# A TYPE: line starting a block of examples in a model response
+_TYPE_RE = re.compile(r"^TYPE:(.*)$", re.M)
+# One Q/A turn within a TYPE block; questions and answers may span lines, and
+# each answer runs until the next Q: line or the end of the block
+_QA_RE = re.compile(
+    r"^Q:\s*(?P<q>.*?)\n+A:\s*(?P<a>.*?)(?=\n+Q:|\Z)", re.S | re.M
+)
 
 try:
     # Initialize Vertex AI with project and location from environment variables
@@ -96,8 +123,9 @@ async def enhance_qa_pair(prompt: str, completion: str) -> List[Dict[str, str]]:
     full_prompt = f"{system_prompt}\n\nNow analyze this:\n{context}"
     
     try:
-        # Try with Gemini Pro first
-        response = model.generate_content(
+        # Try with Gemini Pro first; the SDK call blocks, so run it in a thread
+        response = await asyncio.to_thread(
+            model.generate_content,
             full_prompt,
             generation_config={
                 "temperature": 0.7,
@@ -120,7 +148,8 @@ async def enhance_qa_pair(prompt: str, completion: str) -> List[Dict[str, str]]:
         console.print(f"[yellow]Gemini model failed: {str(e)}. Falling back to Code Bison...[/yellow]")
         try:
             # Fallback to Code Bison
-            response = code_model.predict(
+            response = await asyncio.to_thread(
+                code_model.predict,
                 full_prompt,
                 temperature=0.7,
                 max_output_tokens=8192,
@@ -133,55 +162,65 @@ async def enhance_qa_pair(prompt: str, completion: str) -> List[Dict[str, str]]:
             console.print(f"[red]Both models failed. Error: {str(fallback_e)}[/red]")
             return []
     
+    return parse_qa_pairs(response.text)
+
+def parse_qa_pairs(text: str) -> List[Dict[str, str]]:
+    """Extract prompt/completion pairs from TYPE/Q/A blocks, one per Q/A turn."""
+    parts = _TYPE_RE.split(text)
     qa_pairs = []
-    current_type = None
-    current_q = None
-    current_a = None
-    
-    try:
-        for line in response.text.split('\n'):
-            if line.startswith('TYPE:'):
-                if current_q and current_a:
-                    qa_pairs.append({
-                        "prompt": f"[{current_type}] {current_q.strip()}", 
-                        "completion": current_a.strip()
-                    })
-                current_type = line[5:].strip()
-                current_q = None
-                current_a = None
-            elif line.startswith('Q:'):
-                if current_q and current_a:
-                    qa_pairs.append({
-                        "prompt": f"[{current_type}] {current_q.strip()}", 
-                        "completion": current_a.strip()
-                    })
-                current_q = line[2:].strip()
-                current_a = None
-            elif line.startswith('A:'):
-                current_a = line[2:].strip()
-        
-        # Don't forget the last pair
-        if current_type and current_q and current_a:
-            qa_pairs.append({
-                "prompt": f"[{current_type}] {current_q.strip()}", 
-                "completion": current_a.strip()
-            })
-    except Exception as parse_e:
-        console.print(f"[red]Error parsing model response: {str(parse_e)}[/red]")
-        return []
-    
+    for qa_type, block in zip(parts[1::2], parts[2::2]):
+        for m in _QA_RE.finditer(block):
+            question, answer = m["q"].strip(), m["a"].strip()
+            if question and answer:
+                qa_pairs.append({
+                    "prompt": f"[{qa_type.strip()}] {question}",
+                    "completion": answer,
+                })
     return qa_pairs
 
+class FuncCollector(ast.NodeVisitor):
+    """Collect function definitions from module and class bodies.
+
+    Function bodies are not descended into, so nested helpers are skipped and
+    the expressions inside each function are never visited.
+    """
+
+    def __init__(self) -> None:
+        self.out: List[ast.AST] = []
+
+    def visit_FunctionDef(self, node: ast.FunctionDef) -> None:
+        self.out.append(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+def source_segment(lines: List[str], node: ast.AST) -> str:
+    """Return the source of node, like ast.get_source_segment.
+
+    lines is the source split once per file (keeping line endings), instead of
+    get_source_segment re-splitting the whole file for every node. Column
+    offsets are UTF-8 byte offsets, as in the AST.
+    """
+    first, last = node.lineno - 1, node.end_lineno - 1
+    if first == last:
+        return lines[first].encode()[node.col_offset:node.end_col_offset].decode()
+    head = lines[first].encode()[node.col_offset:].decode()
+    tail = lines[last].encode()[:node.end_col_offset].decode()
+    return "".join([head, *lines[first + 1:last], tail])
+
 async def extract_qa_pairs_from_python(json_file: str) -> List[Dict[str, str]]:
     """Parse the ContextForge JSONL output and extract coding examples."""
     qa_pairs = []
     files = []
+    functions = []
     
-    # Read JSONL format
-    with open(json_file, "r", encoding="utf-8") as f:
+    # Read JSONL format as bytes; the JSON parser handles the trailing newline
+    with open(json_file, "rb") as f:
         for line in f:
+            # Cheap byte checks skip non-records and files that cannot be .py
+            if not line.startswith(b"{") or b'.py"' not in line:
+                continue
             try:
-                file_data = json.loads(line.strip())
+                file_data = json_loads(line)
                 if isinstance(file_data, dict) and "path" in file_data and "content" in file_data:
                     files.append(file_data)
             except json.JSONDecodeError:
@@ -192,48 +231,65 @@ async def extract_qa_pairs_from_python(json_file: str) -> List[Dict[str, str]]:
         if not file["path"].endswith(".py"):
             continue
         try:
-            tree = ast.parse(file["content"])
+            tree = ast.parse(file["content"], type_comments=False)
         except Exception:
             continue
 
-        for node in ast.walk(tree):
-            if isinstance(node, ast.FunctionDef):
-                func_source = ast.get_source_segment(file["content"], node)
-                if func_source:
-                    docstring = ast.get_docstring(node, clean=True)
-                    if docstring:
-                        # Create implementation example
-                        prompt = f"Implement a Python function based on this description:\n{docstring}"
-                        completion = func_source.strip()
-                        qa_pairs.append({"prompt": prompt, "completion": completion})
-                        
-                        # Create docstring example
-                        prompt = f"Write a detailed docstring for the following function:\n\n{func_source.strip()}"
-                        qa_pairs.append({"prompt": prompt, "completion": docstring.strip()})
-                        
-                        # Add enhanced Q/A pairs using Vertex AI
-                        enhanced_pairs = await enhance_qa_pair(docstring, func_source)
-                        qa_pairs.extend(enhanced_pairs)
+        collector = FuncCollector()
+        collector.visit(tree)
+        # Split on \r, \n and \r\n only, as the parser does
+        lines = io.StringIO(file["content"], newline="").readlines()
+        for node in collector.out:
+            func_source = source_segment(lines, node)
+            if func_source:
+                docstring = ast.get_docstring(node, clean=True)
+                if docstring:
+                    functions.append((docstring, func_source))
+
+    # Enhance all functions concurrently, bounded to respect rate limits
+    semaphore = asyncio.Semaphore(ENHANCE_CONCURRENCY)
+
+    async def enhance(docstring: str, func_source: str) -> List[Dict[str, str]]:
+        async with semaphore:
+            return await enhance_qa_pair(docstring, func_source)
+
+    enhanced_results = await asyncio.gather(
+        *(enhance(docstring, func_source) for docstring, func_source in functions),
+        return_exceptions=True,
+    )
+
+    for (docstring, func_source), enhanced_pairs in zip(functions, enhanced_results):
+        # Create implementation example
+        prompt = f"Implement a Python function based on this description:\n{docstring}"
+        completion = func_source.strip()
+        qa_pairs.append({"prompt": prompt, "completion": completion})
+
+        # Create docstring example
+        prompt = f"Write a detailed docstring for the following function:\n\n{func_source.strip()}"
+        qa_pairs.append({"prompt": prompt, "completion": docstring.strip()})
+
+        # Add enhanced Q/A pairs using Vertex AI
+        if isinstance(enhanced_pairs, Exception):
+            console.print(f"[red]Error enhancing Q/A pair: {str(enhanced_pairs)}[/red]")
+            continue
+        qa_pairs.extend(enhanced_pairs)
 
     return qa_pairs
 
-def split_and_write_dataset(qa_pairs: List[Dict[str, str]], train_file: str, valid_file: str, train_split: float = 0.9) -> None:
+def split_and_write_dataset(qa_pairs: List[Dict[str, str]], train_file: str, valid_file: str, train_split: float = 0.9, seed: Optional[int] = None) -> None:
     """Shuffle and split qa_pairs into training and validation sets."""
-    random.shuffle(qa_pairs)
+    # Shuffle indices rather than the pairs, then write both files in one pass
+    indices = list(range(len(qa_pairs)))
+    random.Random(seed).shuffle(indices)
     split_idx = int(len(qa_pairs) * train_split)
-    train_data = qa_pairs[:split_idx]
-    valid_data = qa_pairs[split_idx:]
     
     os.makedirs(os.path.dirname(train_file), exist_ok=True)
-    with open(train_file, "w", encoding="utf-8") as tf:
-        for entry in train_data:
-            tf.write(json.dumps(entry) + "\n")
-    with open(valid_file, "w", encoding="utf-8") as vf:
-        for entry in valid_data:
-            vf.write(json.dumps(entry) + "\n")
+    with open(train_file, "wb") as tf, open(valid_file, "wb") as vf:
+        for i, idx in enumerate(indices):
+            (tf if i < split_idx else vf).write(json_line(qa_pairs[idx]))
             
-    print(f"Wrote {len(train_data)} training examples to {train_file}")
-    print(f"Wrote {len(valid_data)} validation examples to {valid_file}")
+    print(f"Wrote {split_idx} training examples to {train_file}")
+    print(f"Wrote {len(qa_pairs) - split_idx} validation examples to {valid_file}")
 
 async def main():
     # Create a temporary directory for cloning the repo and ContextForge output
@@ -261,5 +317,4 @@ async def main():
     print(MLX_CMD)
     
 if __name__ == "__main__":
-    import asyncio
     asyncio.run(main())
\ No newline at end of file
@@ -1,4 +1,4 @@
-import subprocess
+import re
 from typing import Dict, List
 
 from rich.console import Console
@@ -24,20 +24,34 @@ TEST_CASES = [
     }
 ]
 
+# Every token evaluate_response looks for, found in one pass over the response.
+# The lookahead makes matches zero-width so overlapping tokens are all seen.
+FEATURE_RE = re.compile(
+    r"(?=(?P<memo>@cache|(?i:memo))"
+    r"|(?P<arrow>->)"
+    r"|(?P<colon>:)"
+    r"|(?P<try>try)"
+    r"|(?P<except>except)"
+    r"|(?P<validation>(?i:if not|isinstance|raise))"
+    r"|(?P<complexity>O\(|(?i:complexity|efficient)))"
+)
+# Tokens that must all appear for a feature to count as present
+FEATURE_GROUPS = {
+    "memoization": ("memo",),
+    "type hints": ("arrow", "colon"),
+    "error handling": ("try", "except"),
+    "input validation": ("validation",),
+    "time complexity": ("complexity",),
+}
+
 def evaluate_response(response: str, expected_features: List[str]) -> Dict[str, bool]:
     """Evaluate model response against expected features."""
+    found = {m.lastgroup for m in FEATURE_RE.finditer(response)}
     results = {}
     for feature in expected_features:
-        if feature == "memoization":
-            results[feature] = "@cache" in response or "memo" in response.lower()
-        elif feature == "type hints":
-            results[feature] = "->" in response and ":" in response
-        elif feature == "error handling":
-            results[feature] = "try" in response and "except" in response
-        elif feature == "input validation":
-            results[feature] = any(x in response.lower() for x in ["if not", "isinstance", "raise"])
-        elif feature == "time complexity":
-            results[feature] = "O(" in response or any(x in response.lower() for x in ["complexity", "efficient"])
+        groups = FEATURE_GROUPS.get(feature)
+        if groups:
+            results[feature] = all(g in found for g in groups)
     return results
 
 def run_tests(model_path: str) -> None:
@@ -47,17 +61,27 @@ def run_tests(model_path: str) -> None:
     table.add_column("Expected Features")
     table.add_column("Found Features")
     table.add_column("Score")
+
+    # Load the model and adapter once in-process instead of starting a
+    # python -m mlx_lm.generate subprocess (and reloading) for every test
+    from mlx_lm import generate, load
+    try:
+        model, tokenizer = load(model_path, adapter_path="docstring_adapter")
+    except Exception as e:
+        console.print(f"[red]Error loading model {model_path}: {str(e)}[/red]")
+        return
     
     for test in TEST_CASES:
         try:
-            cmd = f"python -m mlx_lm.generate --model {model_path} --adapter-path docstring_adapter"
-            response = subprocess.run(
-                cmd,
-                shell=True,
-                input=test["prompt"],
-                capture_output=True,
-                text=True
-            ).stdout
+            prompt = test["prompt"]
+            if tokenizer.chat_template is not None:
+                # Match the mlx_lm.generate CLI and LoRA training formatting
+                prompt = tokenizer.apply_chat_template(
+                    [{"role": "user", "content": prompt}],
+                    tokenize=False,
+                    add_generation_prompt=True,
+                )
+            response = generate(model, tokenizer, prompt, max_tokens=512)
             
             results = evaluate_response(response, test["expected_features"])
             score = sum(results.values()) / len(results)
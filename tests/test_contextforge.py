@@ -1,95 +1,248 @@
+import contextlib
+import fnmatch
+import json
+import mmap
 import os
-from datetime import datetime, timedelta
+import re
+import shutil
+import tempfile
+import textwrap
+import threading
+import time
+from pathlib import Path
 from unittest import mock
 from unittest.mock import MagicMock, patch
 
+import click
 import pytest
 from click.testing import CliRunner
 
-from contextforge import cli, is_github_url
+import contextforge
+from contextforge import (
+    SNIFF_FULL_READ_SIZE,
+    _compile_user_regex,
+    cli,
+    is_binary_content,
+    is_github_url,
+)
 
 
-def test_basic_functionality(tmpdir):
-    """Test basic file reading functionality."""
-    runner = CliRunner()
-    with tmpdir.as_cwd():
-        os.makedirs("test_dir")
-        with open("test_dir/file1.txt", "w") as f:
-            f.write("Contents of file1")
+OLD_MTIME = 1704067200  # 2024-01-01T00:00:00Z
+NEW_MTIME = 1704240000  # 2024-01-03T00:00:00Z
+
+# Exact --cxml output for the sample tree's notes.md; {root} is the tree path
+EXPECTED_XML = textwrap.dedent("""\
+    <documents>
+    <document index="1">
+    <source>{root}/notes.md</source>
+    <document_content>
+    Markdown file
+    </document_content>
+    </document>
+    </documents>
+""")
+
+
+def build_tree(root: Path, spec: dict) -> str:
+    """Create the directories (dict values) and files in spec, returning root."""
+    root.mkdir(parents=True, exist_ok=True)
+    for name, value in spec.items():
+        path = root / name
+        if isinstance(value, dict):
+            build_tree(path, value)
+        elif isinstance(value, bytes):
+            path.write_bytes(value)
+        else:
+            path.write_text(value, encoding="utf-8")
+    return str(root)
+
+
+def assert_output(output: str, present=(), absent=()) -> None:
+    """Check all expected and forbidden substrings, reporting every mismatch at once."""
+    missing = [text for text in present if text not in output]
+    unexpected = [text for text in absent if text in output]
+    assert not (missing or unexpected), (
+        f"missing: {missing}, unexpected: {unexpected}\n{output}"
+    )
+
+
+@pytest.fixture
+def fast_tmp_path(tmp_path):
+    """Provide a tmpfs-backed directory where available, else tmp_path."""
+    if not os.access("/dev/shm", os.W_OK):
+        yield tmp_path
+        return
+    path = Path(tempfile.mkdtemp(prefix="contextforge-", dir="/dev/shm"))
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
 
-        result = runner.invoke(cli, ["test_dir"])
-        assert result.exit_code == 0
-        assert "file1.txt" in result.output
-        assert "Contents of file1" in result.output
 
+@pytest.fixture
+def runner():
+    """Provide a Click test runner."""
+    return CliRunner()
 
-def test_include_hidden(tmpdir):
+
+@pytest.fixture(scope="module")
+def sample_tree(tmp_path_factory):
+    """Build a read-only sample tree once for tests that never modify it."""
+    return build_tree(tmp_path_factory.mktemp("sample"), {
+        "file1.txt": "Contents of file1",
+        "test.py": "Python file",
+        "test.txt": "Text file",
+        "happy": "No extension",
+        "notes.md": "Markdown file",
+        ".hidden.txt": "Hidden file",
+        "lines.txt": "\n".join(f"line {i}" for i in range(1, 11)),
+    })
+
+
+def test_basic_functionality(sample_tree, runner):
+    """Test basic file reading functionality."""
+    result = runner.invoke(cli, [sample_tree])
+    assert result.exit_code == 0
+    assert "file1.txt" in result.output
+    assert "Contents of file1" in result.output
+
+
+def test_include_hidden(sample_tree, runner):
     """Test hidden file handling."""
-    runner = CliRunner()
-    with tmpdir.as_cwd():
-        os.makedirs("test_dir")
-        with open("test_dir/.hidden.txt", "w") as f:
-            f.write("Hidden file")
-
-        # Should not include hidden by default
-        result = runner.invoke(cli, ["test_dir"])
-        assert result.exit_code == 0
-        assert ".hidden.txt" not in result.output
+    # Should not include hidden by default
+    result = runner.invoke(cli, [sample_tree])
+    assert result.exit_code == 0
+    assert ".hidden.txt" not in result.output
 
-        # Should include with flag
-        result = runner.invoke(cli, ["test_dir", "--include-hidden"])
-        assert result.exit_code == 0
-        assert ".hidden.txt" in result.output
+    # Should include with flag
+    result = runner.invoke(cli, [sample_tree, "--include-hidden"])
+    assert result.exit_code == 0
+    assert ".hidden.txt" in result.output
 
 
-def test_ignore_patterns(tmpdir):
+@pytest.fixture(scope="module")
+def ignore_tree(tmp_path_factory):
+    """Build a read-only tree shared by the --ignore cases."""
+    return build_tree(tmp_path_factory.mktemp("ignore"), {
+        "ignore.txt": "Ignore this",
+        "keep.py": "Keep this",
+        "subdir": {"out.py": "Nested output", "log.txt": "Nested log"},
+    })
+
+
+@pytest.mark.parametrize("flags, present, absent", [
+    (["--ignore", "*.txt"],
+     ["keep.py", "out.py"], ["ignore.txt", "log.txt"]),
+    (["--ignore", "subdir"],
+     ["keep.py", "ignore.txt"], ["out.py", "log.txt"]),
+    (["--ignore", "subdir", "--ignore-files-only"],
+     ["keep.py", "out.py", "log.txt"], []),
+    (["--ignore", "*.txt", "--ignore", "sub*"],
+     ["keep.py"], ["ignore.txt", "out.py", "log.txt"]),
+])
+def test_ignore_patterns(ignore_tree, flags, present, absent, runner):
     """Test ignore pattern functionality."""
-    runner = CliRunner()
-    with tmpdir.as_cwd():
-        os.makedirs("test_dir")
-        with open("test_dir/ignore.txt", "w") as f:
-            f.write("Ignore this")
-        with open("test_dir/keep.py", "w") as f:
-            f.write("Keep this")
-
-        result = runner.invoke(cli, ["test_dir", "--ignore", "*.txt"])
+    result = runner.invoke(cli, [ignore_tree, *flags])
+    assert result.exit_code == 0
+    assert_output(result.output, present=present, absent=absent)
+
+
+def test_ignore_pattern_compiled_once(tmp_path, monkeypatch, runner):
+    """Test --ignore and --regex patterns are compiled once, not per file."""
+    root = build_tree(tmp_path, {
+        **{f"skip{i}.txt": "Ignored" for i in range(25)},
+        **{f"foo{i}.py": "Kept" for i in range(25)},
+    })
+    translate = mock.Mock(wraps=fnmatch.translate)
+    compile_ = mock.Mock(wraps=re.compile)
+    monkeypatch.setattr(fnmatch, "translate", translate)
+    monkeypatch.setattr(re, "compile", compile_)
+    contextforge.compile_ignore_patterns.cache_clear()
+
+    args = [root, "--ignore", "*.txt", "--regex", "foo.*"]
+    for _ in range(2):
+        result = runner.invoke(cli, args)
         assert result.exit_code == 0
-        assert "ignore.txt" not in result.output
-        assert "keep.py" in result.output
+        assert "skip0.txt" not in result.output
+        assert "foo24.py" in result.output
+
+    # The ignore regex is cached across invocations; --regex once per run
+    assert translate.call_count == 1
+    regex_calls = [c for c in compile_.call_args_list if c.args[0] == "foo.*"]
+    assert len(regex_calls) == 2
+
+
+@pytest.mark.parametrize("patterns", [
+    [f"file{i}.*" for i in range(50)],
+    [f"*_{i}[0-4]?.txt" for i in range(25)] + [f"?{i}*.py" for i in range(25)],
+])
+def test_ignore_union_matches_per_pattern(tmp_path, patterns, runner):
+    """Test the combined --ignore regex agrees with matching each glob alone."""
+    names = [f"file{i}.py" for i in range(60)]
+    names += [f"data_{i}{j}x.txt" for i in range(10) for j in (0, 7)]
+    names += [f"a{i}b.py" for i in range(30)]
+    root = build_tree(tmp_path, {name: name for name in names})
+    compile_ = mock.Mock(wraps=contextforge.re.compile)
+    contextforge.compile_ignore_patterns.cache_clear()
+
+    args = [root, "-l"]
+    for pattern in patterns:
+        args += ["--ignore", pattern]
+    with patch.object(contextforge.re, "compile", compile_):
+        result = runner.invoke(cli, args)
+    assert result.exit_code == 0
+    kept = {os.path.basename(json.loads(line)["path"])
+            for line in result.output.splitlines()}
+    assert kept == {
+        name for name in names
+        if not any(fnmatch.fnmatchcase(name, p) for p in patterns)
+    }
+    # All globs are joined into one alternation compiled in a single call
+    union = "|".join(fnmatch.translate(p) for p in patterns)
+    assert [c for c in compile_.call_args_list if c.args[0] == union] == [
+        mock.call(union)
+    ]
 
 
-def test_extension_filter(tmpdir):
+def test_extension_filter(sample_tree, runner):
     """Test file extension filtering."""
-    runner = CliRunner()
-    with tmpdir.as_cwd():
-        os.makedirs("test_dir")
-        with open("test_dir/test.py", "w") as f:
-            f.write("Python file")
-        with open("test_dir/test.txt", "w") as f:
-            f.write("Text file")
-
-        result = runner.invoke(cli, ["test_dir", "-e", "py"])
-        assert result.exit_code == 0
-        assert "test.py" in result.output
-        assert "test.txt" not in result.output
+    result = runner.invoke(cli, [sample_tree, "-e", "py"])
+    assert result.exit_code == 0
+    assert_output(
+        result.output,
+        present=("test.py",),
+        absent=("test.txt", "happy"),
+    )
+
+    # Extensions may be given with or without the leading dot
+    result = runner.invoke(cli, [sample_tree, "-e", ".md", "-e", "py"])
+    assert result.exit_code == 0
+    assert_output(
+        result.output,
+        present=("notes.md", "test.py"),
+        absent=("test.txt",),
+    )
+
+
+@pytest.mark.parametrize("extension", ["md", ".md"])
+def test_xml_format_dir(sample_tree, extension, runner):
+    """Test the exact XML document layout for a filtered directory."""
+    result = runner.invoke(cli, [sample_tree, "--cxml", "-e", extension])
+    assert result.exit_code == 0
+    assert result.output == EXPECTED_XML.format(root=sample_tree)
 
 
-def test_output_file(tmpdir):
+def test_output_file(tmp_path, runner):
     """Test output to file functionality."""
-    runner = CliRunner()
-    with tmpdir.as_cwd():
-        os.makedirs("test_dir")
-        with open("test_dir/test.txt", "w") as f:
-            f.write("Test content")
-
-        output_file = "output.txt"
-        result = runner.invoke(cli, ["test_dir", "-o", output_file])
-        assert result.exit_code == 0
-        
-        with open(output_file, "r") as f:
-            content = f.read()
-            assert "test.txt" in content
-            assert "Test content" in content
+    # The output file is kept outside the tree being read
+    root = build_tree(tmp_path / "src", {"test.txt": "Test content"})
+
+    output_file = str(tmp_path / "output.txt")
+    result = runner.invoke(cli, [root, "-o", output_file])
+    assert result.exit_code == 0
+    
+    with open(output_file, "r") as f:
+        content = f.read()
+        assert "test.txt" in content
+        assert "Test content" in content
 
 
 def test_github_url_detection():
@@ -98,21 +251,528 @@ def test_github_url_detection():
     assert is_github_url("https://example.com/user/repo") is False
 
 
-@patch('contextforge.Repo')
-def test_github_repo_cloning(mock_repo):
+def test_is_github_url_cached():
+    """Test repeated URL checks are answered from the cache."""
+    urls = [f"https://github.com/user/repo{i}" for i in range(10)]
+    is_github_url.cache_clear()
+    pattern = mock.Mock(wraps=contextforge._GITHUB_URL_RE)
+    with patch("contextforge._GITHUB_URL_RE", pattern):
+        for _ in range(100):
+            for url in urls:
+                assert is_github_url(url) is True
+    assert pattern.match.call_count == 10
+    is_github_url.cache_clear()
+
+
+@patch('git.Repo')
+def test_github_repo_cloning(mock_repo, runner):
     """Test GitHub repository cloning."""
-    runner = CliRunner()
     mock_repo.clone_from = MagicMock()
     
-    with runner.isolated_filesystem():
-        result = runner.invoke(cli, ["https://github.com/user/repo"])
-        assert result.exit_code == 0
-        mock_repo.clone_from.assert_called_once()
+    result = runner.invoke(cli, ["https://github.com/user/repo"])
+    assert result.exit_code == 0
+    mock_repo.clone_from.assert_called_once()
+    assert "--depth=1" in mock_repo.clone_from.call_args.kwargs["multi_options"]
+
+
+@patch('git.Repo')
+def test_github_repo_full_clone_fallback(mock_repo, runner):
+    """Test falling back to a full clone when partial clones are refused."""
+    from git import GitCommandError
+
+    mock_repo.clone_from = MagicMock(side_effect=[
+        GitCommandError("clone", 128, "fatal: server does not support filter"),
+        None,
+    ])
 
+    result = runner.invoke(cli, ["https://github.com/user/repo"])
+    assert result.exit_code == 0
+    assert mock_repo.clone_from.call_count == 2
+    assert "multi_options" not in mock_repo.clone_from.call_args.kwargs
 
-def test_error_handling(tmpdir):
+
+def test_local_run_skips_gitpython(sample_tree, runner):
+    """Test GitPython is only imported when a repository is cloned."""
+    with patch.dict("sys.modules", {"git": None}):
+        result = runner.invoke(cli, [sample_tree])
+    assert result.exit_code == 0
+    assert "Contents of file1" in result.output
+
+
+def test_error_handling(tmp_path, runner):
     """Test basic error handling."""
-    runner = CliRunner()
-    result = runner.invoke(cli, ["non_existent_path"])
+    result = runner.invoke(cli, [str(tmp_path / "non_existent_path")])
     assert result.exit_code == 1
-    assert "Error" in result.output or "error" in result.output
\ No newline at end of file
+    assert "Error" in result.output or "error" in result.output
+
+    # Regex validation is checked directly, without a CLI round-trip
+    with pytest.raises(click.ClickException, match="Invalid regex pattern"):
+        _compile_user_regex("[invalid")
+    assert _compile_user_regex(None) is None
+    assert _compile_user_regex(r"\.py$").search("a.py")
+
+def test_nested_directories_and_gitignore(tmp_path, runner):
+    """Test recursive traversal honours .gitignore for files and directories."""
+    root = build_tree(tmp_path, {
+        ".gitignore": "generated/\n*.log\n!keep.log\n",
+        "src": {
+            "pkg": {"module.py": "Nested module"},
+            "debug.log": "Log output",
+            "keep.log": "Negated rule",
+        },
+        "generated": {"artifact.txt": "Build artifact"},
+    })
+
+    result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert_output(
+        result.output,
+        present=("Nested module", "Negated rule"),
+        absent=("debug.log", "artifact.txt"),
+    )
+
+
+def test_line_numbers(sample_tree, runner):
+    """Test line numbering in plain text and XML output."""
+    for args in (["-n"], ["-n", "--cxml"]):
+        result = runner.invoke(cli, [sample_tree, *args])
+        assert result.exit_code == 0
+        assert " 1  line 1\n" in result.output
+        assert "10  line 10\n" in result.output
+
+
+def test_line_numbers_skip_invalid_utf8(tmp_path, runner):
+    """Test a non-UTF-8 text file is skipped whole with line numbers on."""
+    root = build_tree(tmp_path, {
+        "latin.txt": b"caf\xe9\n",
+        "notes.txt": "Real notes",
+    })
+
+    result = runner.invoke(cli, [root, "-n"])
+    assert result.exit_code == 0
+    assert "latin.txt" not in result.output
+    assert result.output == f"{root}/notes.txt\n---\n1  Real notes\n\n---\n\n"
+
+    result = runner.invoke(cli, [root, "-n", "--cxml"])
+    assert result.exit_code == 0
+    assert "latin.txt" not in result.output
+    assert result.output.count("<document_content>") == 1
+    assert result.output.count("</document_content>") == 1
+
+
+@pytest.mark.parametrize("repeat", [1, SNIFF_FULL_READ_SIZE // 8])
+def test_line_numbers_match_splitlines(tmp_path, repeat, runner):
+    """Test streamed and in-memory numbering split lines the same way."""
+    # The larger file is streamed from disk; the smaller one is read whole
+    content = "a\fb\nc\x85d\u2028\n" * repeat
+    root = build_tree(tmp_path, {"ff.txt": content})
+
+    result = runner.invoke(cli, [root, "-n", "-l"])
+    assert result.exit_code == 0
+    numbered = json.loads(result.output)["content"]
+    assert numbered.count("\n") + 1 == len(content.splitlines())
+
+    result = runner.invoke(cli, [root, "-n"])
+    assert result.exit_code == 0
+    # Compare line by line; a diff of the whole output is slow to render
+    streamed = result.output.split("\n")
+    expected = f"{root}/ff.txt\n---\n{numbered}\n\n---\n\n".split("\n")
+    assert len(streamed) == len(expected)
+    assert next(((a, b) for a, b in zip(streamed, expected) if a != b), None) is None
+
+
+def test_binary_content_detection():
+    """Test the binary content heuristic."""
+    assert is_binary_content(b"plain text\n") is False
+    assert is_binary_content("ünïcødé".encode("utf-8")) is False
+    assert is_binary_content(b"text\x00with null") is True
+    assert is_binary_content(bytes(range(1, 32)) * 4) is True
+    assert is_binary_content(b"") is False
+    # The ratio is over the sample only, and exactly 30% still counts as text
+    assert is_binary_content(b"\x01" * 3 + b"a" * 7) is False
+    assert is_binary_content(b"\x01" * 4 + b"a" * 6) is True
+    assert is_binary_content(b"a" * 1024 + b"\x01" * 1024) is False
+
+
+def test_binary_files_skipped(tmp_path, runner):
+    """Test binary files are skipped by extension and by magic number."""
+    root = build_tree(tmp_path, {
+        "image.png": b"not really an image",
+        "report.txt": b"%PDF-1.4 disguised pdf",
+        "notes.txt": "Real notes",
+    })
+
+    result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert_output(
+        result.output,
+        present=("Real notes",),
+        absent=("image.png", "report.txt"),
+    )
+
+
+def test_large_binary_rejected_on_header(fast_tmp_path, runner):
+    """Test a large binary file is rejected from its header without being mapped."""
+    root = build_tree(fast_tmp_path, {
+        "blob.dat": b"\x00\xff" * (5 * 1024 * 1024),
+        "notes.txt": "Real notes",
+    })
+
+    with patch("contextforge._map_fd") as map_fd, \
+            patch("contextforge.os.read", wraps=os.read) as read:
+        result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert "blob.dat" not in result.output
+    assert "Real notes" in result.output
+    map_fd.assert_not_called()
+    sizes = [call.args[1] for call in read.call_args_list]
+    assert all(size <= SNIFF_FULL_READ_SIZE + 1 for size in sizes)
+
+
+def test_jsonl_output(tmp_path, runner):
+    """Test JSONL output is one valid JSON object per file."""
+    root = build_tree(tmp_path / "src", {
+        "a.py": "print('ünïcødé')\n",
+        "b.md": "# Title",
+    })
+
+    output_file = tmp_path / "out.jsonl"
+    result = runner.invoke(cli, [root, "-l", "-o", str(output_file)])
+    assert result.exit_code == 0
+    with open(output_file, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [os.path.basename(r["path"]) for r in records] == ["a.py", "b.md"]
+    assert records[0]["content"] == "print('ünïcødé')\n"
+
+
+def test_concurrent_file_read_deterministic_output(fast_tmp_path, runner):
+    """Test output follows sorted path order whatever order reads finish in."""
+    names = [f"f{i:03d}.txt" for i in range(100)]
+    root = build_tree(fast_tmp_path, {name: name for name in names})
+
+    read_file = contextforge._read_file
+
+    def slow_early_reads(file_path, *args):
+        # Earlier files finish last within each prefetch window
+        index = int(os.path.basename(file_path)[1:4])
+        time.sleep((100 - index) * 0.0002)
+        return read_file(file_path, *args)
+
+    with patch("contextforge._read_file", side_effect=slow_early_reads):
+        result = runner.invoke(cli, [root, "-l"])
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [os.path.basename(r["path"]) for r in records] == names
+    assert [r["content"] for r in records] == names
+
+
+def test_regex_filter(tmp_path, runner):
+    """Test --regex filtering and invalid pattern handling."""
+    root = build_tree(tmp_path, {
+        "test_one.py": "Test module",
+        "helper.py": "Helper module",
+    })
+
+    result = runner.invoke(cli, [root, "--regex", r"/test_[^/]*\.py$"])
+    assert result.exit_code == 0
+    assert "test_one.py" in result.output
+    assert "helper.py" not in result.output
+
+    result = runner.invoke(cli, [root, "--regex", "[invalid"])
+    assert result.exit_code == 1
+    assert "Invalid regex pattern" in result.output
+
+
+def test_dataset_mode(tmp_path, runner):
+    """Test dataset mode tree overview, summaries and delimiters."""
+    root = build_tree(tmp_path, {"pkg": {"mod.py": "x = 1\n"}})
+
+    result = runner.invoke(cli, [root, "--dataset-mode"])
+    assert result.exit_code == 0
+    assert_output(
+        result.output,
+        present=(
+            "📂 pkg/\n",
+            "  📄 pkg/mod.py\n",
+            "| 6 bytes | 1 lines | snippet: x = 1",
+            f"===== FILE BEGIN: {root}/pkg/mod.py =====",
+        ),
+    )
+
+
+def test_json_array_output(tmp_path, runner):
+    """Test JSON array output stays valid across files and invocations."""
+    root = build_tree(tmp_path, {
+        name: f"Contents of {name}" for name in ("a.txt", "b.txt", "c.txt")
+    })
+
+    for _ in range(2):
+        result = runner.invoke(cli, [root, "-j"])
+        assert result.exit_code == 0
+        data = json.loads(result.output)
+        assert [os.path.basename(d["path"]) for d in data] == [
+            "a.txt", "b.txt", "c.txt"
+        ]
+
+
+@pytest.mark.parametrize("flag", ["-l", "-j"])
+def test_json_output_undecodable_file_name(tmp_path, flag, runner):
+    """Test JSON output escapes file names that are not valid UTF-8."""
+    try:
+        (Path(os.fsdecode(os.fsencode(tmp_path) + b"/caf\xe9.txt"))
+         .write_text("Café notes", encoding="utf-8"))
+    except (OSError, UnicodeError):
+        pytest.skip("file system rejects non-UTF-8 file names")
+
+    result = runner.invoke(cli, [str(tmp_path), flag])
+    assert result.exit_code == 0
+    assert "\\udce9" in result.output
+    data = json.loads(result.output)
+    record = data[0] if flag == "-j" else data
+    assert record["path"].endswith("caf\udce9.txt")
+    assert record["content"] == "Café notes"
+
+
+def test_default_prune(tmp_path, runner):
+    """Test heavy directories are skipped unless --no-default-prune is given."""
+    root = build_tree(tmp_path, {
+        "node_modules": {"pkg": {"index.js": "Vendored code"}},
+        "app.js": "App code",
+    })
+
+    result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert "App code" in result.output
+    assert "Vendored code" not in result.output
+
+    result = runner.invoke(cli, [root, "--no-default-prune"])
+    assert result.exit_code == 0
+    assert "Vendored code" in result.output
+
+    result = runner.invoke(cli, [root, "--no-sort"])
+    assert result.exit_code == 0
+    assert "App code" in result.output
+    assert "Vendored code" not in result.output
+
+
+def test_nested_gitignore(tmp_path, runner):
+    """Test .gitignore files in subdirectories apply beneath them."""
+    root = build_tree(tmp_path, {
+        ".gitignore": "*.log\n",
+        "top.tmp": "Top temp",
+        "sub": {
+            ".gitignore": "*.tmp\n!trace.log\n",
+            "scratch.tmp": "Sub temp",
+            "trace.log": "Re-included log",
+            "other.log": "Other log",
+        },
+    })
+
+    result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert_output(
+        result.output,
+        present=("Top temp", "Re-included log"),
+        absent=("Sub temp", "Other log"),
+    )
+
+
+def test_gitignore_cache_hits(tmp_path, monkeypatch, runner):
+    """Test .gitignore files are parsed once until their mtime changes."""
+    root = build_tree(tmp_path, {
+        ".gitignore": "*.log\n",
+        "debug.log": "Log output",
+        "notes.txt": "Notes",
+    })
+    gitignore = tmp_path / ".gitignore"
+    from_lines = mock.Mock(wraps=contextforge.GitIgnoreSpec.from_lines)
+    monkeypatch.setattr(contextforge.GitIgnoreSpec, "from_lines", from_lines)
+    contextforge._load_gitignore_cached.cache_clear()
+
+    for _ in range(2):
+        result = runner.invoke(cli, [root])
+        assert result.exit_code == 0
+        assert "Log output" not in result.output
+    assert from_lines.call_count == 1
+
+    # A rewritten .gitignore gets a new mtime and is parsed again
+    gitignore.write_text("*.txt\n")
+    mtime_ns = gitignore.stat().st_mtime_ns + 1_000_000_000
+    os.utime(gitignore, ns=(mtime_ns, mtime_ns))
+    result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert "Log output" in result.output
+    assert "Notes" not in result.output
+    assert from_lines.call_count == 2
+
+
+def test_modification_time_filtering(tmp_path, runner):
+    """Test --modified-after filtering."""
+    root = build_tree(tmp_path, {
+        "old.txt": "Old file",
+        "new.txt": "New file",
+    })
+    # Fixed mtimes a day either side of the cutoff, whatever the local zone
+    os.utime(f"{root}/old.txt", (OLD_MTIME, OLD_MTIME))
+    os.utime(f"{root}/new.txt", (NEW_MTIME, NEW_MTIME))
+
+    result = runner.invoke(cli, [root, "--modified-after", "2024-01-02"])
+    assert result.exit_code == 0
+    assert "New file" in result.output
+    assert "Old file" not in result.output
+
+
+def test_scandir_single_stat_per_file(tmp_path, monkeypatch, runner):
+    """Test size and mtime filters stat each file once, through its DirEntry."""
+    names = {f"file{i}.txt": "x" * i for i in range(1, 6)}
+    root = build_tree(tmp_path, {"sub": dict(names)})
+    entry_stats = []
+    path_stats = []
+    real_scandir = os.scandir
+    real_stat = os.stat
+
+    class CountingEntry:
+        def __init__(self, entry):
+            self._entry = entry
+
+        def __getattr__(self, name):
+            return getattr(self._entry, name)
+
+        def stat(self, **kwargs):
+            entry_stats.append(self._entry.name)
+            return self._entry.stat(**kwargs)
+
+    @contextlib.contextmanager
+    def counting_scandir(path):
+        with real_scandir(path) as it:
+            yield [CountingEntry(entry) for entry in it]
+
+    def counting_stat(path, *args, **kwargs):
+        if os.path.basename(path) in names:
+            path_stats.append(path)
+        return real_stat(path, *args, **kwargs)
+
+    monkeypatch.setattr(contextforge.os, "scandir", counting_scandir)
+    monkeypatch.setattr(contextforge.os, "stat", counting_stat)
+
+    # Without size or mtime filters nothing is stat'ed at all
+    result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert "file5.txt" in result.output
+    assert entry_stats == [] and path_stats == []
+
+    args = [root, "--min-size", "2", "--modified-after", "2000-01-01"]
+    result = runner.invoke(cli, args)
+    assert result.exit_code == 0
+    assert "file1.txt" not in result.output
+    assert "file5.txt" in result.output
+    assert sorted(entry_stats) == sorted(names)
+    assert path_stats == []
+
+
+def test_large_file_content(fast_tmp_path, runner):
+    """Test files above the fast-read threshold are read completely."""
+    content = "".join(f"line {i}\n" for i in range(40000))
+    root = build_tree(fast_tmp_path, {"large.txt": content})
+
+    result = runner.invoke(cli, [root, "-l"])
+    assert result.exit_code == 0
+    assert json.loads(result.output)["content"] == content
+
+    # A file given directly takes the same memory-mapped read path
+    result = runner.invoke(cli, [f"{root}/large.txt", "-l"])
+    assert result.exit_code == 0
+    assert json.loads(result.output)["content"] == content
+
+    # Plain text and XML output stream the file in chunks
+    result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert f"{root}/large.txt\n---\n{content}\n\n---\n" in result.output
+    result = runner.invoke(cli, [root, "--cxml"])
+    assert result.exit_code == 0
+    assert f"<document_content>\n{content}\n</document_content>" in result.output
+
+    # A large file that is not valid UTF-8 is skipped without partial output
+    build_tree(fast_tmp_path, {
+        "bad.txt": content.encode() + b"\xff\xfe",
+    })
+    result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert "bad.txt" not in result.output
+    assert "large.txt" in result.output
+
+
+def test_large_files_decoded_one_at_a_time(fast_tmp_path, runner):
+    """Test JSON output decodes large files on the consuming thread only."""
+    content = "x" * (SNIFF_FULL_READ_SIZE + 1)
+    root = build_tree(fast_tmp_path, {
+        f"large{i}.txt": content for i in range(4)
+    })
+    decode_text = contextforge.decode_text
+    threads = []
+
+    def record_thread(data):
+        if isinstance(data, mmap.mmap):
+            threads.append(threading.current_thread())
+        return decode_text(data)
+
+    with patch("contextforge.decode_text", side_effect=record_thread):
+        result = runner.invoke(cli, [root, "-l"])
+    assert result.exit_code == 0
+    assert [json.loads(line)["content"] for line in result.output.splitlines()] == (
+        [content] * 4
+    )
+    assert threads == [threading.current_thread()] * 4
+
+
+@pytest.mark.skipif(not hasattr(os, "posix_fadvise"), reason="needs posix_fadvise")
+def test_large_file_readahead_hint(fast_tmp_path, runner):
+    """Test only files read beyond the first chunk get a readahead hint."""
+    root = build_tree(fast_tmp_path, {
+        "large.txt": "x" * (SNIFF_FULL_READ_SIZE + 1),
+        "small.txt": "small",
+    })
+
+    with patch("contextforge.os.posix_fadvise") as fadvise:
+        result = runner.invoke(cli, [root])
+    assert result.exit_code == 0
+    assert "small" in result.output
+    fadvise.assert_called_once()
+    assert fadvise.call_args.args[1:] == (0, 0, os.POSIX_FADV_WILLNEED)
+
+
+def test_ignored_directories_not_entered(tmp_path, monkeypatch, runner):
+    """Test ignored directories are pruned before they are scanned."""
+    scanned = []
+    real_scandir = os.scandir
+
+    def recording_scandir(path):
+        scanned.append(os.path.basename(os.path.normpath(path)))
+        return real_scandir(path)
+
+    monkeypatch.setattr(contextforge.os, "scandir", recording_scandir)
+    root = build_tree(tmp_path, {
+        ".gitignore": "vendor/\n",
+        **{d: {"file.txt": f"{d} file"} for d in ("vendor", "skipme", "src")},
+    })
+
+    result = runner.invoke(cli, [root, "--ignore", "skipme"])
+    assert result.exit_code == 0
+    assert "src file" in result.output
+    assert "src" in scanned
+    assert "vendor" not in scanned
+    assert "skipme" not in scanned
+
+
+def test_xml_output_indexes_restart(tmp_path, runner):
+    """Test XML document indexes count per run instead of across runs."""
+    root = build_tree(tmp_path, {"a.txt": "a.txt", "b.txt": "b.txt"})
+
+    for _ in range(2):
+        result = runner.invoke(cli, [root, "--cxml"])
+        assert result.exit_code == 0
+        assert_output(
+            result.output,
+            present=('<document index="1">', '<document index="2">'),
+            absent=('<document index="3">',),
+        )
@@ -0,0 +1,46 @@
+import pytest
+
+from test_model import evaluate_response
+
+
+@pytest.mark.parametrize("response, feature, expected", [
+    # Memoization: @cache is case-sensitive, memo is not
+    ("@cache\ndef fib(n):", "memoization", True),
+    ("@Cache", "memoization", False),
+    ("uses MEMOization", "memoization", True),
+    # Type hints need both an arrow and a colon
+    ("def f(x: int) -> int:", "type hints", True),
+    ("def f(x) -> int", "type hints", False),
+    ("def f(x: int):", "type hints", False),
+    # Error handling needs both try and except, case-sensitively
+    ("try:\n    pass\nexcept ValueError:\n    pass", "error handling", True),
+    ("try:\n    pass\nfinally:\n    pass", "error handling", False),
+    ("Try it. Except this.", "error handling", False),
+    # Input validation tokens are case-insensitive
+    ("IF NOT x: return", "input validation", True),
+    ("IsInstance(x, int)", "input validation", True),
+    ("Raise ValueError", "input validation", True),
+    ("if x: return", "input validation", False),
+    # O( is case-sensitive; complexity and efficient are not
+    ("runs in O(n)", "time complexity", True),
+    ("runs in o(n)", "time complexity", False),
+    ("lower COMPLEXITY", "time complexity", True),
+])
+def test_evaluate_response(response, feature, expected):
+    """Test each feature's tokens and their case sensitivity."""
+    assert evaluate_response(response, [feature]) == {feature: expected}
+
+
+def test_evaluate_response_overlapping_tokens():
+    """Test tokens sharing characters are each found."""
+    features = ["memoization", "time complexity"]
+    assert evaluate_response("@cachefficient", features) == {
+        "memoization": True, "time complexity": True
+    }
+
+
+def test_evaluate_response_skips_unknown_features():
+    """Test features without a token check are left out of the results."""
+    assert evaluate_response("try: except", ["error handling", "docstring"]) == {
+        "error handling": True
+    }